@@ -1,4 +1,15 @@
+import bisect
+import collections
+import functools
+from array import array
 import re
+import sys
+
+try:
+    from re import _constants, _parser
+except ImportError:  # Python < 3.11
+    import sre_constants as _constants
+    import sre_parse as _parser
 
 from lexer import RegexLexer, include, bygroups, default, combined, words
 from pygments.token import (
@@ -13,7 +24,9 @@ from pygments.token import (
     Error,
     Whitespace,
     Other,
+    _TokenType,
 )
+from pygments.lexers._lua_builtins import MODULES as _LUA_MODULES
 from pygments.util import get_bool_opt, get_list_opt
 
 __all__ = [
@@ -21,10 +34,37 @@ __all__ = [
 ]
 
 
-def all_lua_builtins():
-    from pygments.lexers._lua_builtins import MODULES
+_WS_TOKENS = frozenset((Comment.Multiline, Comment.Single, Whitespace))
 
-    return [w for values in MODULES.values() for w in values]
+_KEYWORDS_RESERVED = frozenset(
+    (
+        "break",
+        "do",
+        "else",
+        "elseif",
+        "end",
+        "for",
+        "if",
+        "in",
+        "repeat",
+        "return",
+        "then",
+        "until",
+        "while",
+    )
+)
+_KEYWORDS_CONSTANT = frozenset(("true", "false", "nil"))
+_OPERATORS_WORD = frozenset(("and", "or", "not"))
+
+_ALL_LUA_BUILTINS = tuple(w for values in _LUA_MODULES.values() for w in values)
+_LUA_BUILTINS = frozenset(_ALL_LUA_BUILTINS)
+# the part before the dot of every builtin, e.g. "string" for "string.find"
+_LUA_BUILTIN_HEADS = frozenset(w.partition(".")[0] for w in _ALL_LUA_BUILTINS)
+_builtin_member_re = re.compile(r"\.(\w+)")
+
+
+def all_lua_builtins():
+    return list(_ALL_LUA_BUILTINS)
 
 
 class LuaLexer(RegexLexer):
@@ -57,10 +97,23 @@ class LuaLexer(RegexLexer):
     mimetypes = ["text/x-lua", "application/x-lua"]
     version_added = ""
 
-    _comment_multiline = r"(?:--\[(?P<level>=*)\[[\w\W]*?\](?P=level)\])"
-    _comment_single = r"(?:--.*$)"
+    # "--[[" is by far the most common opener, so try it before the form
+    # that has to check the closing level with a backreference
+    _comment_multiline_fast = r"(?:--\[\[(?s:.*?)\]\])"
+    _comment_multiline_level = r"(?:--\[(?P<level>=+)\[(?s:.*?)\](?P=level)\])"
+    _comment_multiline = rf"(?:{_comment_multiline_fast}|{_comment_multiline_level})"
+    _comment_single = r"(?:--[^\n]*)"
     _space = r"(?:\s+)"
     _s = rf"(?:{_comment_multiline}|{_comment_single}|{_space})"
+    # A run of whitespace and comments, matched atomically: once the run has
+    # been consumed the engine may not backtrack into it, otherwise a failing
+    # lookahead retries every way of splitting the run (``(\s+)*`` is
+    # exponential).  Python < 3.11 has no possessive quantifiers, so emulate
+    # one with a capturing lookahead and a backreference.
+    if sys.version_info >= (3, 11):
+        _s_run = rf"(?:{_s})*+"
+    else:
+        _s_run = rf"(?=(?P<s_run>(?:{_s})*))(?P=s_run)"
     _name = r"(?:[^\W\d]\w*)"
 
     tokens = {
@@ -70,7 +123,8 @@ class LuaLexer(RegexLexer):
             default("base"),
         ],
         "ws": [
-            (_comment_multiline, Comment.Multiline),
+            (_comment_multiline_fast, Comment.Multiline),
+            (_comment_multiline_level, Comment.Multiline),
             (_comment_single, Comment.Single),
             (_space, Whitespace),
         ],
@@ -86,51 +140,33 @@ class LuaLexer(RegexLexer):
             (r"\.{3}", Punctuation),
             (r"[=<>|~&+\-*/%#^]+|\.\.", Operator),
             (r"[\[\]{}().,:;]+", Punctuation),
-            (r"(and|or|not)\b", Operator.Word),
-            (
-                words(
-                    [
-                        "break",
-                        "do",
-                        "else",
-                        "elseif",
-                        "end",
-                        "for",
-                        "if",
-                        "in",
-                        "repeat",
-                        "return",
-                        "then",
-                        "until",
-                        "while",
-                    ],
-                    suffix=r"\b",
-                ),
-                Keyword.Reserved,
-            ),
-            (r"goto\b", Keyword.Reserved, "goto"),
-            (r"(local)\b", Keyword.Declaration),
-            (r"(true|false|nil)\b", Keyword.Constant),
-            (r"(function)\b", Keyword.Reserved, "funcname"),
-            (words(all_lua_builtins(), suffix=r"\b"), Name.Builtin),
-            (rf"[A-Za-z_]\w*(?={_s}*[.:])", Name.Variable, "varname"),
-            (rf"[A-Za-z_]\w*(?={_s}*\()", Name.Function),
-            (r"[A-Za-z_]\w*", Name.Variable),
+            # Keywords and builtins are looked up by _get_raw_tokens.  Whether
+            # any other identifier is a function or a variable depends on what
+            # follows it; "after_ident" looks ahead and get_tokens_unprocessed
+            # relabels the token.
+            (r"[A-Za-z_]\w*", Name.Variable, "after_ident"),
             ("'", String.Single, combined("stringescape", "sqs")),
             ('"', String.Double, combined("stringescape", "dqs")),
         ],
+        "after_ident": [
+            include("ws"),
+            # "::" starts a label, not a method call
+            (r"(?=\.|:(?!:))", Name.Variable, ("#pop", "varname")),
+            (r"(?=\()", Name.Function, "#pop"),
+            default("#pop"),
+        ],
         "varname": [
             include("ws"),
             (r"\.\.", Operator, "#pop"),
             (r"[.:]", Punctuation),
-            (rf"{_name}(?={_s}*[.:])", Name.Property),
-            (rf"{_name}(?={_s}*\()", Name.Function, "#pop"),
+            (rf"{_name}(?={_s_run}[.:])", Name.Property),
+            (rf"{_name}(?={_s_run}\()", Name.Function, "#pop"),
             (_name, Name.Property, "#pop"),
         ],
         "funcname": [
             include("ws"),
             (r"[.:]", Punctuation),
-            (rf"{_name}(?={_s}*[.:])", Name.Class),
+            (rf"{_name}(?={_s_run}[.:])", Name.Class),
             (_name, Name.Function, "#pop"),
             # inline function
             (r"\(", Punctuation, "#pop"),
@@ -161,33 +197,503 @@ class LuaLexer(RegexLexer):
         ],
     }
 
+    # token type and state transition for each keyword matched as an
+    # identifier in "base"
+    _keywords = {
+        **dict.fromkeys(_KEYWORDS_RESERVED, (Keyword.Reserved, None)),
+        **dict.fromkeys(_KEYWORDS_CONSTANT, (Keyword.Constant, None)),
+        **dict.fromkeys(_OPERATORS_WORD, (Operator.Word, None)),
+        "goto": (Keyword.Reserved, ("goto",)),
+        "local": (Keyword.Declaration, None),
+        "function": (Keyword.Reserved, ("funcname",)),
+    }
+
     def __init__(self, **options):
         self.func_name_highlighting = get_bool_opt(
             options, "func_name_highlighting", True
         )
         self.disabled_modules = get_list_opt(options, "disabled_modules", [])
 
-        self._functions = set()
+        functions = set()
         if self.func_name_highlighting:
-            from pygments.lexers._lua_builtins import MODULES
-
-            for mod, func in MODULES.items():
+            for mod, func in _LUA_MODULES.items():
                 if mod not in self.disabled_modules:
-                    self._functions.update(func)
+                    functions.update(func)
+        self._functions = frozenset(functions)
         RegexLexer.__init__(self, **options)
 
+        cls = type(self)
+        if "_fused_tokens" not in cls.__dict__:
+            cls._fused_tokens = {
+                state: _dispatch_table(rules, cls.flags)
+                for state, rules in self._tokens.items()
+            }
+
     def get_tokens_unprocessed(self, text):
-        for index, token, value in RegexLexer.get_tokens_unprocessed(self, text):
-            if token is Name.Builtin and value not in self._functions:
-                if "." in value:
-                    a, b = value.split(".")
-                    yield index, Name, a
-                    yield index + len(a), Punctuation, "."
-                    yield index + len(a) + 1, Name, b
-                else:
-                    yield index, Name, value
+        return self._resolve_tokens(self._get_raw_tokens(text))
+
+    def get_tokens_incremental(self, text, previous=None):
+        """
+        Lex ``text``, reusing the tokens of an earlier version of it.
+
+        `previous` is the state returned by the call for the earlier text, or
+        None.  Return ``(tokens, state)``, where `tokens` is the list that
+        `get_tokens_unprocessed` would yield.  Lexing restarts at the last line
+        break before the edit that nothing earlier depends on, and stops at
+        the first such line break after it that lines up with the old tokens.
+        """
+        if previous is None:
+            previous = ("", [], [])
+        old_text, old_tokens, old_syncs = previous
+        prefix, suffix = _common_affixes(old_text, text)
+        delta = len(text) - len(old_text)
+        edit_end = len(text) - suffix
+
+        # syncs are (position, number of tokens before it) pairs
+        k = bisect.bisect_left(old_syncs, (prefix,)) - 1
+        if k >= 0:
+            pos, count = old_syncs[k]
+            stack = ("root", "base")
+        else:
+            pos, count, stack = 0, 0, ("root",)
+        tokens = old_tokens[:count]
+        syncs = old_syncs[: max(k, 0)]
+
+        breaks = []
+        next_break = 0
+        after_name = unclosed = False
+        raw = self._get_raw_tokens(text, stack, pos, breaks)
+        for index, token, value in self._resolve_tokens(raw):
+            while next_break < len(breaks) and breaks[next_break] < index:
+                next_break += 1
+            if (
+                next_break < len(breaks)
+                and breaks[next_break] == index
+                and not after_name
+                and not unclosed
+            ):
+                if index >= edit_end:
+                    k = bisect.bisect_left(old_syncs, (index - delta,))
+                    if k < len(old_syncs) and old_syncs[k][0] == index - delta:
+                        # the rest lexes exactly as before
+                        count = old_syncs[k][1]
+                        shift = len(tokens) - count
+                        syncs.extend((p + delta, c + shift) for p, c in old_syncs[k:])
+                        tokens.extend(
+                            (i + delta, t, v) for i, t, v in old_tokens[count:]
+                        )
+                        break
+                syncs.append((index, len(tokens)))
+            tokens.append((index, token, value))
+            if token not in _WS_TOKENS:
+                after_name = token in Name
+            # a long bracket that never closes was matched up to the end of
+            # the text, so everything after it depends on the whole rest
+            unclosed = unclosed or _opens_long_bracket(text, index, token, value)
+        return tokens, (text, tokens, syncs)
+
+    def _resolve_tokens(self, raw):
+        stream = _TokenStream(raw)
+        for index, token, value in stream:
+            if token is Name.Builtin:
+                yield from self._builtin_tokens(index, value)
+            elif token is Name.Variable:
+                # an identifier lexed in "base"
+                yield from self._identifier_tokens(stream, index, value)
+            else:
+                yield index, token, value
+
+    def get_tokens_batched(self, text, batch=4096):
+        """
+        Like `get_tokens_unprocessed`, but yield the tokens in chunks of up to
+        `batch` as three parallel sequences: an ``array("q")`` of indices, an
+        ``array("B")`` of token ids (see `TOKEN_TYPES`) and a list of values.
+        """
+        token_ids = TOKEN_ID_TABLE
+        indices, ids, values = array("q"), array("B"), []
+        for index, token, value in self.get_tokens_unprocessed(text):
+            indices.append(index)
+            ids.append(token_ids[token])
+            values.append(value)
+            if len(values) == batch:
+                yield indices, ids, values
+                indices, ids, values = array("q"), array("B"), []
+        if values:
+            yield indices, ids, values
+
+    def _get_raw_tokens(self, text, stack=("root",), pos=0, breaks=None):
+        """
+        Lex ``text`` like `RegexLexer.get_tokens_unprocessed`, except that
+        each state picks its matching rule with a single regex match from
+        ``_fused_tokens`` instead of trying each rule in turn.  That regex only
+        contains the rules that can match the character at ``pos``.
+        Identifiers lexed in "base" that are keywords or builtins get their
+        token type here, so they never enter "after_ident".
+
+        If `breaks` is a list, the positions of tokens containing a line break
+        that are lexed with only "root" and one state on the stack are
+        appended to it.
+        """
+        tokendefs = self._tokens
+        keywords = self._keywords
+        builtins, builtin_heads = _LUA_BUILTINS, _LUA_BUILTIN_HEADS
+        seen = {}
+        statestack = list(stack)
+        statetokens = tokendefs[statestack[-1]]
+        dispatch = self._fused_tokens[statestack[-1]]
+        while 1:
+            try:
+                char = ord(text[pos])
+            except IndexError:
+                char = 256
+            fused = dispatch[0][char] if char < 256 else dispatch[1]
+            m = fused[0](text, pos) if fused is not None else None
+            if m:
+                group = m.lastindex
+                rexmatch, action, new_state = statetokens[fused[1][group]]
+                if action is not None and type(action) is not _TokenType:
+                    # callbacks expect the rule's own group numbering
+                    m = rexmatch(text, pos)
+                    group = 0
+                end = m.end()
+                if action is not None:
+                    if type(action) is _TokenType:
+                        value = m.group(group)
+                        if len(value) < 16:
+                            # keywords, operators and most identifiers repeat
+                            # throughout a file; share one string for each.
+                            # Not sys.intern: interned strings may never be
+                            # freed, and values here are arbitrary source text
+                            value = seen.setdefault(value, value)
+                        if action is Name.Variable and value in keywords:
+                            action, new_state = keywords[value]
+                        elif action is Name.Variable and value in builtin_heads:
+                            member = _builtin_member_re.match(text, end)
+                            if member and f"{value}.{member[1]}" in builtins:
+                                value = f"{value}.{member[1]}"
+                                end = member.end()
+                                action, new_state = Name.Builtin, None
+                            elif value in builtins:
+                                action, new_state = Name.Builtin, None
+                        if breaks is not None and len(statestack) == 2:
+                            if "\n" in value:
+                                breaks.append(pos)
+                        yield pos, action, value
+                    else:
+                        yield from action(self, m)
+                pos = end
+                if new_state is not None:
+                    # state transition
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == "#pop":
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == "#push":
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        # pop, but keep at least one state on the stack
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == "#push":
+                        statestack.append(statestack[-1])
+                    else:
+                        assert False, f"wrong state def: {new_state!r}"
+                    statetokens = tokendefs[statestack[-1]]
+                    dispatch = self._fused_tokens[statestack[-1]]
                 continue
-            yield index, token, value
+            # no rule matched
+            try:
+                if text[pos] == "\n":
+                    # at EOL, reset state to "root"
+                    statestack = ["root"]
+                    statetokens = tokendefs["root"]
+                    dispatch = self._fused_tokens["root"]
+                    yield pos, Whitespace, "\n"
+                    pos += 1
+                    continue
+                yield pos, Error, text[pos]
+                pos += 1
+            except IndexError:
+                break
+
+    def _identifier_tokens(self, stream, index, value):
+        """
+        Classify an identifier lexed in "base" and yield it together with the
+        whitespace after it.  "after_ident" follows the identifier with a
+        zero-width marker if it is called or indexed.
+        """
+        trailing = stream.take_ws()
+        nxt = stream.peek()
+        call = False
+        if nxt is not None and not nxt[2]:
+            next(stream)
+            call = nxt[1] is Name.Function
+        yield index, Name.Function if call else Name.Variable, value
+        yield from trailing
+
+    def _builtin_tokens(self, index, value):
+        if value in self._functions:
+            yield index, Name.Builtin, value
+            return
+        a, dot, b = value.partition(".")
+        if dot:
+            yield index, Name, a
+            yield index + len(a), Punctuation, "."
+            yield index + len(a) + 1, Name, b
+        else:
+            yield index, Name, value
+
+
+_global_flags_re = re.compile(r"\(\?([aiLmsux]+)\)")
+_backref_re = re.compile(r"(?<!\\)((?:\\\\)*)\\([1-9]\d?)")
+_group_name_re = re.compile(r"(?<!\\)((?:\\\\)*)\(\?P([<=])(\w+)")
+
+
+def _common_affixes(a, b, step=4096):
+    """
+    Return the lengths of the common prefix and of the common suffix of `a`
+    and `b`, not overlapping in either string.
+    """
+    limit = min(len(a), len(b))
+    prefix = 0
+    # compare in chunks first; slices compare much faster than characters
+    while prefix + step <= limit and (
+        a[prefix : prefix + step] == b[prefix : prefix + step]
+    ):
+        prefix += step
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    limit -= prefix
+    a_end, b_end = len(a), len(b)
+    while limit >= step and a[a_end - step : a_end] == b[b_end - step : b_end]:
+        a_end -= step
+        b_end -= step
+        limit -= step
+    while limit and a[a_end - 1] == b[b_end - 1]:
+        a_end -= 1
+        b_end -= 1
+        limit -= 1
+    return prefix, len(a) - a_end
+
+
+_long_bracket_re = re.compile(r"\[=*\[")
+
+
+def _opens_long_bracket(text, index, token, value):
+    """
+    Return whether a token is a long bracket that failed to match a long
+    string or comment, which `LuaLexer` then lexes as punctuation or as a
+    single-line comment.
+    """
+    if token is Comment.Single:
+        return _long_bracket_re.match(value, 2) is not None
+    if token is Punctuation or token is Error:
+        start = value.find("[")
+        while start >= 0:
+            if _long_bracket_re.match(text, index + start):
+                return True
+            start = value.find("[", start + 1)
+    return False
+
+
+def _dispatch_table(rules, flags):
+    """
+    Build the dispatch for the processed rules of a state, compiled with the
+    lexer's `flags`.
+
+    Returns a list with, for each Latin-1 character, the `_fuse_rules` result
+    for just the rules that can match starting with it (or None if no rule
+    can), and the result for all rules, used for other characters and at
+    the end of the text.
+    """
+    starts = [_first_chars(rexmatch.__self__) for rexmatch, _, _ in rules]
+    by_candidates = {}
+    table = []
+    for char in range(256):
+        candidates = tuple(
+            i for i, chars in enumerate(starts) if chars is None or char in chars
+        )
+        if candidates not in by_candidates:
+            by_candidates[candidates] = (
+                _fuse_rules(rules, candidates, flags) if candidates else None
+            )
+        table.append(by_candidates[candidates])
+    return table, _fuse_rules(rules, range(len(rules)), flags)
+
+
+@functools.lru_cache(maxsize=None)
+def _first_chars(compiled):
+    """
+    Return the set of Latin-1 code points a match of ``compiled`` can start
+    with, or None if it can match the empty string.
+    """
+    parsed = _parser.parse(compiled.pattern, compiled.flags)
+    chars, nullable = _first_chars_of(parsed, compiled.flags)
+    return None if nullable else chars
+
+
+def _first_chars_of(items, flags):
+    # Returns (chars, nullable) for a parsed (sub)pattern; errs on the side of
+    # too many characters for anything it does not understand.
+    chars = set()
+    for op, av in items:
+        if op is _constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            first, nullable = _first_chars_of(sub, (flags | add_flags) & ~del_flags)
+        elif op is _ATOMIC_GROUP:
+            first, nullable = _first_chars_of(av, flags)
+        elif op is _constants.BRANCH:
+            first, nullable = set(), False
+            for sub in av[1]:
+                sub_first, sub_nullable = _first_chars_of(sub, flags)
+                first |= sub_first
+                nullable = nullable or sub_nullable
+        elif op in _REPEATS:
+            low, _, sub = av
+            first, nullable = _first_chars_of(sub, flags)
+            nullable = nullable or not low
+        elif op is _constants.ASSERT and av[0] == 1:
+            # a lookahead constrains the next character like consuming would
+            first, nullable = _first_chars_of(av[1], flags)
+        elif op in (_constants.ASSERT, _constants.ASSERT_NOT, _constants.AT):
+            continue
+        elif op in (_constants.LITERAL, _constants.NOT_LITERAL, _constants.IN):
+            first, nullable = _single_char_set(op, av, flags), False
+        else:
+            # ANY, backreferences, ...
+            return set(range(256)), True
+        chars |= first
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+def _single_char_set(op, av, flags):
+    if op is _constants.LITERAL:
+        cls = re.escape(chr(av))
+    elif op is _constants.NOT_LITERAL:
+        cls = f"[^{re.escape(chr(av))}]"
+    else:
+        parts = []
+        for item_op, item_av in av:
+            if item_op is _constants.NEGATE:
+                parts.insert(0, "^")
+            elif item_op is _constants.LITERAL:
+                parts.append(re.escape(chr(item_av)))
+            elif item_op is _constants.RANGE:
+                low, high = item_av
+                parts.append(f"{re.escape(chr(low))}-{re.escape(chr(high))}")
+            elif item_op is _constants.CATEGORY:
+                parts.append(_CATEGORIES[item_av])
+            else:
+                return set(range(256))
+        cls = f"[{''.join(parts)}]"
+    match = re.compile(cls, flags & re.IGNORECASE).match
+    return {char for char in range(256) if match(chr(char))}
+
+
+# atomic groups and possessive repeats are new in Python 3.11
+_ATOMIC_GROUP = getattr(_constants, "ATOMIC_GROUP", None)
+_REPEATS = (_constants.MAX_REPEAT, _constants.MIN_REPEAT) + (
+    (_constants.POSSESSIVE_REPEAT,) if hasattr(_constants, "POSSESSIVE_REPEAT") else ()
+)
+_CATEGORIES = {
+    _constants.CATEGORY_DIGIT: r"\d",
+    _constants.CATEGORY_NOT_DIGIT: r"\D",
+    _constants.CATEGORY_SPACE: r"\s",
+    _constants.CATEGORY_NOT_SPACE: r"\S",
+    _constants.CATEGORY_WORD: r"\w",
+    _constants.CATEGORY_NOT_WORD: r"\W",
+}
+
+
+def _fuse_rules(rules, candidates, flags):
+    """
+    Combine the processed ``rules`` at the indices ``candidates`` into one
+    regex, compiled with the same lexer `flags` as the rules themselves.
+
+    Each rule becomes an alternative wrapped in a capturing group, in rule
+    order, so the first alternative that matches is the rule `RegexLexer`
+    would have picked.  Returns the combined ``match`` method and a list
+    mapping the ``lastindex`` of a match to the index of the winning rule.
+    """
+    alternatives = []
+    group_to_rule = [None]
+    for i in candidates:
+        compiled = rules[i][0].__self__
+        pattern = compiled.pattern
+        # global inline flags are only allowed at the very start
+        inline = _global_flags_re.match(pattern)
+        if inline:
+            pattern = f"(?{inline.group(1)}:{pattern[inline.end():]})"
+        # shift numbered backreferences past the groups of earlier rules
+        offset = len(group_to_rule)
+        pattern = _backref_re.sub(
+            lambda m: f"{m.group(1)}(?:\\{offset + int(m.group(2))})", pattern
+        )
+        # rules in one state may use the same group names
+        pattern = _group_name_re.sub(rf"\1(?P\2\3_{i}", pattern)
+        alternatives.append(f"({pattern})")
+        group_to_rule.extend([i] * (compiled.groups + 1))
+    fused = re.compile("|".join(alternatives), flags)
+    return fused.match, group_to_rule
+
+
+class _TokenStream:
+    """
+    Iterator over ``(index, token, value)`` tuples that can look ahead.
+    """
+
+    def __init__(self, tokens):
+        self._tokens = iter(tokens)
+        self._buffer = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._buffer:
+            return self._buffer.popleft()
+        return next(self._tokens)
+
+    def peek(self, n=0):
+        """Return the `n`-th upcoming token without consuming it, or None."""
+        while len(self._buffer) <= n:
+            try:
+                self._buffer.append(next(self._tokens))
+            except StopIteration:
+                return None
+        return self._buffer[n]
+
+    def take_ws(self):
+        """Consume and return the upcoming whitespace and comment tokens."""
+        ws = []
+        while (tok := self.peek()) is not None and tok[1] in _WS_TOKENS:
+            ws.append(next(self))
+        return ws
+
+
+#: Every token type `LuaLexer` emits, indexed by the ids that
+#: `LuaLexer.get_tokens_batched` yields.
+TOKEN_TYPES = tuple(
+    dict.fromkeys(
+        [
+            rule[1]
+            for rules in LuaLexer.tokens.values()
+            for rule in rules
+            if isinstance(rule, tuple) and type(rule[1]) is _TokenType
+        ]
+        + [token for token, new_state in LuaLexer._keywords.values()]
+        # emitted by get_tokens_unprocessed and the error handling
+        + [Name, Name.Builtin, Punctuation, Whitespace, Error]
+    )
+)
+TOKEN_ID_TABLE = {token: i for i, token in enumerate(TOKEN_TYPES)}
 
 
 def _luau_make_expression(should_pop, _s):
@@ -1,25 +1,28 @@
+import io
+import mmap
 import re
+import sys
+
+from scripting import LuaLexer
 
 tokens = []
-with open("test.lua", "r", encoding="utf-8") as file:
-    content = file.read()
-# content = content.replace("    ", "\t")
+# Lua sources are ASCII; scan the mapped file as bytes instead of decoding it
+with open("test.lua", "rb") as file:
+    content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
 
 
-_comment_multiline = r"(?:--\[(?P<level>=*)\[[\w\W]*?\](?P=level)\])"
-_comment_single = r"(?:--.*$)"
-_space = r"(?:\s+)"
-_s = rf"(?:{_comment_multiline}|{_comment_single}|{_space})"
+# match the whitespace/comment run possessively, like the lexer does; a
+# plain ``(?:...)*`` retries every split of the run when the lookahead fails
+_s_run = LuaLexer._s_run
 _name = r"(?:[^\W\d]\w*)"
 
-func_rexmatch = re.compile(rf"[A-Za-z_]\w*(?={_s}*\()", re.MULTILINE).match
-var_rexmatch = re.compile(rf"[A-Za-z_]\w*(?={_s}*[.:])", re.MULTILINE).match
-
-pos = 0
+func_pattern = re.compile(rf"[A-Za-z_]\w*(?={_s_run}\()".encode("ascii"))
+var_pattern = re.compile(rf"[A-Za-z_]\w*(?={_s_run}[.:])".encode("ascii"))
 
-while pos < len(content):
-    # once we get to pos = 261, match checking takes a long time
-    print("pos", pos)
-    print("Function match", func_rexmatch(content, pos))
-    print("Variable match", func_rexmatch(content, pos))
-    pos += 1
+# collect the output and write it once, so the timing is the regex cost
+out = io.StringIO()
+for m in func_pattern.finditer(content):
+    out.write(f"Function match {m.start()} {m.group().decode('ascii')}\n")
+for m in var_pattern.finditer(content):
+    out.write(f"Variable match {m.start()} {m.group().decode('ascii')}\n")
+sys.stdout.write(out.getvalue())